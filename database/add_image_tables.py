@@ -0,0 +1,30 @@
+import os
+import sys
+import psycopg
+
+from dotenv import load_dotenv
+
+from setup import create_image_tables
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scraper"))
+from image_scraper import backfill_image_index
+
+
+load_dotenv()
+
+
+conn = psycopg.connect(os.getenv("DATABASE_URL"))
+cur = conn.cursor()
+
+create_image_tables(cur)
+
+conn.commit()
+
+cur.close()
+conn.close()
+
+print("Successfully added image tables.")
+
+backfill_image_index()
+
+print("Successfully indexed existing images.")
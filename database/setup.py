@@ -42,6 +42,26 @@ def create_menu_tables_and_indexes(cursor):
         CREATE INDEX idx_menu_items_date_name ON menu_items (item_name, menu_id);
     """)
 
+
+def create_image_tables(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS images (
+            content_hash CHAR(64) PRIMARY KEY,
+            phash BIGINT NOT NULL,
+            url VARCHAR(256) NOT NULL,
+            source VARCHAR(1024)
+        );
+    """)
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS image_searches (
+            query VARCHAR(64) PRIMARY KEY,
+            image VARCHAR(256) NOT NULL,
+            image_source VARCHAR(1024)
+        );
+    """)
+
+
 if __name__ == "__main__":
     try:
         database_url = DATABASE_URL.rsplit("/", 1)[0] + "/postgres"
@@ -70,6 +90,8 @@ if __name__ == "__main__":
         DROP TABLE IF EXISTS menu_items CASCADE;
         DROP TABLE IF EXISTS menus CASCADE;
         DROP TABLE IF EXISTS items CASCADE;
+        DROP TABLE IF EXISTS image_searches CASCADE;
+        DROP TABLE IF EXISTS images CASCADE;
         DROP TYPE IF EXISTS menu_status_enum;
         DROP TYPE IF EXISTS menu_meal_enum;
     """)
@@ -89,6 +111,7 @@ if __name__ == "__main__":
     )
 
     create_menu_tables_and_indexes(cur)
+    create_image_tables(cur)
 
     conn.commit()
 
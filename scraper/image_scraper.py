@@ -1,11 +1,14 @@
 import os
+import re
 import hashlib
+import unicodedata
 from io import BytesIO
 
 import boto3
 import psycopg
 import requests
 from dotenv import load_dotenv
+from PIL import Image, UnidentifiedImageError
 
 
 load_dotenv()
@@ -16,6 +19,9 @@ API_URL = "https://customsearch.googleapis.com/customsearch/v1?key=%s&cx=%s&sear
 GOOGLE_IMAGES_API_KEY = os.getenv("GOOGLE_IMAGES_API_KEY")
 GOOGLE_IMAGES_CSE_ID = os.getenv("GOOGLE_IMAGES_CSE_ID")
 
+# Max differing bits between two perceptual hashes to treat the images as the same
+PHASH_MAX_DISTANCE = 6
+
 s3_client = boto3.client(
     "s3",
     endpoint_url=os.getenv("S3_ENDPOINT"),
@@ -28,8 +34,97 @@ conn.autocommit = True
 cur = conn.cursor(row_factory=psycopg.rows.dict_row)
 
 
+def strip_qualifiers(item_name: str) -> str:
+    """
+    "Scrambled Eggs (Cage-Free)" -> "Scrambled Eggs"
+    """
+    return " ".join(re.sub(r"\(.*?\)|\[.*?\]", " ", item_name).split())
+
+
+def normalize_item_name(item_name: str) -> str:
+    """
+    "Crème Brûlée (Vegetarian)" -> "creme brulee"
+    """
+    name = unicodedata.normalize("NFKD", strip_qualifiers(item_name).lower())
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    name = re.sub(r"['\u2019]", "", name)
+    name = re.sub(r"[^\w ]+|_", " ", name)
+    return " ".join(name.split())
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """
+    64-bit difference hash, returned as a signed int to fit in a BIGINT column.
+    """
+    pixels = list(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).getdata())
+
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def find_stored_image(content_hash: str, phash: int) -> dict | None:
+    cur.execute("SELECT url, source FROM images WHERE content_hash = %s;", (content_hash,))
+    row = cur.fetchone()
+    if row:
+        return row
+
+    # Full scan over every stored hash; fine for the few thousand menu items we store.
+    cur.execute("""
+        SELECT url, source FROM images
+        WHERE bit_count((phash # %s)::bit(64)) <= %s
+        ORDER BY bit_count((phash # %s)::bit(64))
+        LIMIT 1;
+    """, (phash, PHASH_MAX_DISTANCE, phash))
+    return cur.fetchone()
+
+
+def hash_image(image_content: bytes) -> tuple[str, int] | None:
+    try:
+        phash = perceptual_hash(Image.open(BytesIO(image_content)))
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError, ValueError, SyntaxError):
+        return None
+
+    return hashlib.sha256(image_content).hexdigest(), phash
+
+
+def store_image(image_content: bytes, image_link: str) -> dict | None:
+    hashes = hash_image(image_content)
+    if hashes is None:
+        return None
+
+    content_hash, phash = hashes
+    stored = find_stored_image(content_hash, phash)
+    if stored:
+        print(f"Reused: {stored['url']}")
+        return stored
+
+    s3_client.upload_fileobj(BytesIO(image_content), os.getenv("R2_BUCKET_NAME"), content_hash,
+                             ExtraArgs={"ACL": "public-read"})
+    public_url = f"{os.getenv('R2_PUBLIC_URL')}/{content_hash}"
+    print(f"Added: {public_url}")
+
+    cur.execute("INSERT INTO images (content_hash, phash, url, source) VALUES (%s, %s, %s, %s);",
+                (content_hash, phash, public_url, image_link))
+    return {"url": public_url, "source": image_link}
+
+
 def scrape_image(item_name: str, offset: bool=False) -> str:
-    url = API_URL % (GOOGLE_IMAGES_API_KEY, GOOGLE_IMAGES_CSE_ID, item_name + " plated food image")
+    query = normalize_item_name(item_name) or item_name
+
+    if not offset:
+        cur.execute("SELECT image, image_source FROM image_searches WHERE query = %s;", (query,))
+        cached = cur.fetchone()
+        if cached:
+            print(f"Cached ({item_name}): {cached['image']}")
+            cur.execute("UPDATE items SET image = %s, image_source = %s WHERE name = %s;",
+                        (cached["image"], cached["image_source"], item_name))
+            return cached["image"]
+
+    search_term = strip_qualifiers(item_name) or item_name
+    url = API_URL % (GOOGLE_IMAGES_API_KEY, GOOGLE_IMAGES_CSE_ID, search_term + " plated food image")
     if offset:
        url += "&start=11"
     response = requests.get(url, timeout=15)
@@ -38,30 +133,29 @@ def scrape_image(item_name: str, offset: bool=False) -> str:
         print(f"Error ({item_name}):", response.json())
         return ""
 
-    image_data = None
+    stored = None
     for image in response.json()["items"]:
-        image_link = image["link"]
-
         try:
-            image_response = requests.get(image_link, timeout=5)
+            image_response = requests.get(image["link"], timeout=5)
             if image_response.status_code == 200:
-                image_data = BytesIO(image_response.content)
-                break
-        except:
+                stored = store_image(image_response.content, image["link"])
+                if stored:
+                    break
+        except requests.RequestException:
             continue
     
-    if image_data is None:
+    if stored is None:
         if not offset:
             return scrape_image(item_name, True)
         return ""
-    
-    image_name = hashlib.md5(item_name.encode()).hexdigest()
-    s3_client.upload_fileobj(image_data, os.getenv("R2_BUCKET_NAME"), image_name, ExtraArgs={"ACL": "public-read"})
-    public_url = f"{os.getenv('R2_PUBLIC_URL')}/{image_name}"
-    print(f"Added: {public_url}")
 
-    cur.execute("UPDATE items SET image = %s, image_source = %s WHERE name = %s;", (public_url, image_link, item_name))
-    return image_name
+    cur.execute("""
+        INSERT INTO image_searches (query, image, image_source) VALUES (%s, %s, %s)
+        ON CONFLICT (query) DO UPDATE SET image = EXCLUDED.image, image_source = EXCLUDED.image_source;
+    """, (query, stored["url"], stored["source"]))
+    cur.execute("UPDATE items SET image = %s, image_source = %s WHERE name = %s;",
+                (stored["url"], stored["source"], item_name))
+    return stored["url"]
 
 
 def scrape_all_images() -> None:
@@ -73,6 +167,45 @@ def scrape_all_images() -> None:
         scrape_image(row["name"])
 
 
+def backfill_image_index() -> None:
+    """
+    Index images scraped before deduplication existed and cache their items' searches.
+    """
+    cur.execute("SELECT name, image, image_source FROM items WHERE image IS NOT NULL ORDER BY name;")
+    rows = cur.fetchall()
+
+    for row in rows:
+        cur.execute("""
+            INSERT INTO image_searches (query, image, image_source) VALUES (%s, %s, %s)
+            ON CONFLICT (query) DO NOTHING;
+        """, (normalize_item_name(row["name"]) or row["name"], row["image"], row["image_source"]))
+
+    cur.execute("SELECT url FROM images;")
+    indexed = {row["url"] for row in cur.fetchall()}
+
+    print(f"Indexing images for {len(rows)} items.")
+    for row in rows:
+        if row["image"] in indexed:
+            continue
+        indexed.add(row["image"])
+
+        try:
+            image_response = requests.get(row["image"], timeout=5)
+        except requests.RequestException:
+            continue
+        if image_response.status_code != 200:
+            continue
+
+        hashes = hash_image(image_response.content)
+        if hashes is None:
+            continue
+
+        cur.execute("""
+            INSERT INTO images (content_hash, phash, url, source) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (content_hash) DO NOTHING;
+        """, (*hashes, row["image"], row["image_source"]))
+
+
 def main():
     scrape_all_images()
 